@@ -1,34 +1,75 @@
+import asyncio
+import base64
+import binascii
+import hashlib
+import hmac
+import json
+import time
+import uuid
 from datetime import datetime, timedelta, timezone
-from typing import Optional
+from typing import Optional, Union
+from cachetools import TTLCache
 from jose import JWTError, jwt
 import bcrypt
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, literal
 from app.config import get_settings
-from app.database import get_db
+from app.database import engine, get_db
 from app import models
 
 settings = get_settings()
 bearer_scheme = HTTPBearer()
 
+# raw token -> (user_id, exp); skips the HMAC verify for tokens seen recently
+_token_cache: TTLCache = TTLCache(maxsize=10_000, ttl=60)
+# user_id -> column dict of the User row; short TTL so profile edits show up quickly
+_user_cache: TTLCache = TTLCache(maxsize=10_000, ttl=5)
 
-def hash_password(password: str) -> str:
+_hs256_key = settings.secret_key.encode("utf-8")
+
+
+def _hash_password(password: str) -> str:
     # bcrypt requires bytes
     pwd_bytes = password.encode('utf-8')
-    salt = bcrypt.gensalt()
+    salt = bcrypt.gensalt(rounds=settings.password_hash_cost)
     hash_bytes = bcrypt.hashpw(pwd_bytes, salt)
     return hash_bytes.decode('utf-8')
 
 
-def verify_password(plain: str, hashed: str) -> bool:
+def _verify_password(plain: str, hashed: str) -> bool:
     try:
         return bcrypt.checkpw(plain.encode('utf-8'), hashed.encode('utf-8'))
     except Exception:
         return False
 
 
+def safe_equals(a: Union[str, bytes], b: Union[str, bytes]) -> bool:
+    """Constant-time comparison for secrets (tokens, signatures, invite codes).
+
+    Use this instead of ``==`` whenever either side is secret, so the
+    comparison time doesn't leak how many leading bytes matched.
+    """
+    if isinstance(a, str):
+        a = a.encode("utf-8")
+    if isinstance(b, str):
+        b = b.encode("utf-8")
+    return hmac.compare_digest(a, b)
+
+
+# bcrypt is deliberately slow; run it in the default executor so a login
+# doesn't stall every other request on the event loop.
+async def hash_password(password: str) -> str:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, _hash_password, password)
+
+
+async def verify_password(plain: str, hashed: str) -> bool:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, _verify_password, plain, hashed)
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     to_encode = data.copy()
     expire = datetime.now(timezone.utc) + (
@@ -38,6 +79,89 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     return jwt.encode(to_encode, settings.secret_key, algorithm=settings.algorithm)
 
 
+def _b64url_decode(segment: str) -> bytes:
+    return base64.urlsafe_b64decode(segment + "=" * (-len(segment) % 4))
+
+
+def _decode_hs256(token: str) -> dict:
+    """Verify an HS256 token with hmac/hashlib directly, skipping jose's dispatch.
+
+    Only the checks our own tokens need: signature and ``exp``.
+    """
+    try:
+        header_b64, payload_b64, signature_b64 = token.split(".")
+        header = json.loads(_b64url_decode(header_b64))
+        signature = _b64url_decode(signature_b64)
+        signing_input = f"{header_b64}.{payload_b64}".encode("ascii")
+    except (ValueError, binascii.Error) as e:
+        raise JWTError("Malformed token") from e
+    if not isinstance(header, dict) or header.get("alg") != "HS256":
+        raise JWTError("Unsupported token algorithm")
+
+    expected = hmac.new(_hs256_key, signing_input, hashlib.sha256).digest()
+    if not safe_equals(expected, signature):
+        raise JWTError("Signature verification failed")
+
+    try:
+        payload = json.loads(_b64url_decode(payload_b64))
+    except (ValueError, binascii.Error) as e:
+        raise JWTError("Malformed token payload") from e
+    if not isinstance(payload, dict):
+        raise JWTError("Malformed token payload")
+    exp = payload.get("exp")
+    if exp is not None and (not isinstance(exp, (int, float)) or exp <= time.time()):
+        raise JWTError("Signature has expired")
+    return payload
+
+
+def _decode_token(token: str) -> Optional[str]:
+    """Return the user id encoded in a valid token, or None."""
+    cached = _token_cache.get(token)
+    if cached is not None:
+        user_id, exp = cached
+        if exp > time.time():
+            return user_id
+        _token_cache.pop(token, None)
+        return None
+
+    try:
+        if settings.algorithm == "HS256":
+            payload = _decode_hs256(token)
+        else:
+            payload = jwt.decode(token, settings.secret_key, algorithms=[settings.algorithm])
+    except JWTError:
+        return None
+    user_id = payload.get("sub")
+    if not user_id:
+        return None
+    _token_cache[token] = (user_id, payload.get("exp", float("inf")))
+    return user_id
+
+
+async def _load_user(db: AsyncSession, user_id: str) -> Optional[models.User]:
+    """Fetch a user by id, serving recent lookups from an in-process cache.
+
+    Cache hits return a session-less, read-only ``User`` built from the
+    cached column values (up to a few seconds old); to modify the user, load
+    the row in your own session instead.
+    """
+    row = _user_cache.get(user_id)
+    if row is not None:
+        return models.User(**row)
+
+    result = await db.execute(select(models.User).where(models.User.id == user_id))
+    user = result.scalar_one_or_none()
+    if user is not None:
+        _user_cache[user_id] = {
+            c.key: getattr(user, c.key) for c in models.User.__table__.columns
+        }
+    return user
+
+
+def invalidate_user_cache(user_id) -> None:
+    _user_cache.pop(str(user_id), None)
+
+
 async def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme),
     db: AsyncSession = Depends(get_db),
@@ -47,35 +171,31 @@ async def get_current_user(
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(
-            credentials.credentials,
-            settings.secret_key,
-            algorithms=[settings.algorithm],
-        )
-        user_id: str = payload.get("sub")
-        if user_id is None:
-            raise credentials_exception
-    except JWTError:
+    user_id = _decode_token(credentials.credentials)
+    if user_id is None:
         raise credentials_exception
 
-    result = await db.execute(
-        select(models.User).where(models.User.id == user_id)
-    )
-    user = result.scalar_one_or_none()
+    user = await _load_user(db, user_id)
     if user is None:
         raise credentials_exception
     return user
 
 
-async def get_current_user_ws(token: str, db: AsyncSession) -> Optional[models.User]:
-    """For WebSocket auth (token passed as query param)."""
+async def get_current_user_id_ws(token: str) -> Optional[str]:
+    """For WebSocket auth (token passed as query param).
+
+    Returns the user id without opening an ORM session: users seen recently
+    are answered from the cache, others with a bare existence check.
+    """
+    user_id = _decode_token(token)
+    if not user_id:
+        return None
+    if user_id in _user_cache:
+        return user_id
     try:
-        payload = jwt.decode(token, settings.secret_key, algorithms=[settings.algorithm])
-        user_id: str = payload.get("sub")
-        if not user_id:
-            return None
-        result = await db.execute(select(models.User).where(models.User.id == user_id))
-        return result.scalar_one_or_none()
-    except JWTError:
+        uid = uuid.UUID(user_id)
+    except ValueError:
         return None
+    async with engine.connect() as conn:
+        found = await conn.scalar(select(literal(1)).where(models.User.id == uid))
+    return user_id if found else None
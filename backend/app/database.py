@@ -8,8 +8,8 @@ engine = create_async_engine(
     settings.database_url,
     echo=False,
     pool_pre_ping=True,
-    pool_size=10,
-    max_overflow=20,
+    pool_size=settings.db_pool_size,
+    max_overflow=settings.db_max_overflow,
 )
 
 AsyncSessionLocal = async_sessionmaker(
@@ -33,7 +33,16 @@ async def get_db():
             await session.close()
 
 
+def _create_missing_indexes(sync_conn):
+    # create_all skips tables that already exist, including their indexes,
+    # so indexes added to existing models are created here.
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(sync_conn, checkfirst=True)
+
+
 async def create_tables():
     async with engine.begin() as conn:
         from app import models  # noqa: F401
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_create_missing_indexes)
@@ -1,3 +1,4 @@
+import asyncio
 import os
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Query
@@ -5,11 +6,9 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from app.database import create_tables
 from app.config import get_settings
-from app.services import search_index
-from app.services.transcription_service import load_whisper_model
+from app.services import search_index, transcription_service
 from app import websocket as ws_manager
-from app.auth import get_current_user_ws
-from app.database import AsyncSessionLocal
+from app.auth import get_current_user_id_ws
 from app.routers import users, rooms, messages, search
 
 settings = get_settings()
@@ -22,22 +21,32 @@ async def lifespan(app: FastAPI):
     await create_tables()
 
     print("[Startup] Creating upload directories...")
-    os.makedirs(os.path.join(settings.upload_dir, "voice"), exist_ok=True)
-    os.makedirs(os.path.join(settings.upload_dir, "images"), exist_ok=True)
+    for subfolder in ("voice", "images", "videos", "docs", "misc"):
+        os.makedirs(os.path.join(settings.upload_dir, subfolder), exist_ok=True)
 
     print("[Startup] Initializing FAISS index and embedding model...")
     search_index.initialize()
+    workers = [
+        asyncio.create_task(search_index.run_embedding_worker()),
+        asyncio.create_task(search_index.run_search_batcher()),
+        asyncio.create_task(search_index.run_persistence_loop()),
+    ]
 
-    print("[Startup] Pre-loading Whisper model (this may take a moment)...")
-    import threading
-    threading.Thread(target=load_whisper_model, daemon=True).start()
+    print("[Startup] Starting Whisper worker process (model loads in the background)...")
+    transcription_service.start_worker()
 
     print("[Startup] All systems ready done")
     yield
 
     # ── Shutdown ──────────────────────────────────────────────────────────
+    for worker in workers:
+        worker.cancel()
+    await asyncio.gather(*workers, return_exceptions=True)
+
+    transcription_service.shutdown_worker()
+
     print("[Shutdown] Saving FAISS index...")
-    search_index._save_index()
+    search_index.flush()
 
 
 app = FastAPI(
@@ -75,21 +84,30 @@ async def websocket_endpoint(
     websocket: WebSocket,
     token: str = Query(...),
 ):
-    async with AsyncSessionLocal() as db:
-        user = await get_current_user_ws(token, db)
-
-    if not user:
+    user_id = await get_current_user_id_ws(token)
+    if not user_id:
         await websocket.close(code=4001)
         return
 
-    await ws_manager.connect(room_id, websocket, user_id=str(user.id))
+    await ws_manager.connect(room_id, websocket, user_id=user_id)
     try:
         while True:
-            # Keep connection alive; messages are sent server→client only via broadcast
-            data = await websocket.receive_text()
-            # Client can send a ping to keep alive
-    except WebSocketDisconnect:
-        await ws_manager.disconnect(room_id, websocket, user_id=str(user.id))
+            # Messages are sent server→client only via broadcast; client frames
+            # are drained without decoding. Uvicorn answers protocol-level pings.
+            try:
+                message = await asyncio.wait_for(
+                    websocket.receive(), timeout=settings.ws_keepalive_seconds
+                )
+            except asyncio.TimeoutError:
+                # Idle: probe the client so half-open sockets get dropped
+                await websocket.send_text('{"type":"ping"}')
+                continue
+            if message["type"] == "websocket.disconnect":
+                break
+    except (WebSocketDisconnect, RuntimeError, OSError):
+        pass
+    finally:
+        await ws_manager.disconnect(room_id, websocket, user_id=user_id)
 
 
 @app.get("/health")
@@ -2,7 +2,7 @@ import uuid
 from datetime import datetime, timezone
 from sqlalchemy import (
     Column, String, Boolean, DateTime, ForeignKey,
-    Text, Enum as SAEnum
+    Index, Text, Enum as SAEnum, func, literal_column, text
 )
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
@@ -60,6 +60,28 @@ class RoomMember(Base):
     room = relationship("Room", back_populates="members")
     user = relationship("User", back_populates="room_memberships")
 
+    __table_args__ = (
+        # membership check on every message send / read
+        Index("ix_room_members_user_room", "user_id", "room_id"),
+    )
+
+
+SEARCH_CONFIG = literal_column("'simple'::regconfig")
+
+
+def search_vector(content, transcription):
+    """Full-text document for keyword search over content + transcription.
+
+    Queries must use this exact expression for Postgres to answer them from
+    the ix_messages_search GIN index.
+    """
+    return func.to_tsvector(
+        SEARCH_CONFIG,
+        func.coalesce(content, literal_column("''"))
+        .concat(literal_column("' '"))
+        .concat(func.coalesce(transcription, literal_column("''"))),
+    )
+
 
 class Message(Base):
     __tablename__ = "messages"
@@ -76,7 +98,32 @@ class Message(Base):
     faiss_index_id = Column(String(64), nullable=True)  # FAISS mapping key
     created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
     is_deleted = Column(Boolean, default=False)
-    deleted_for = Column(Text, nullable=True)  # comma-separated user IDs of those who deleted for themselves
 
     sender = relationship("User", back_populates="sent_messages", foreign_keys=[sender_id])
     room = relationship("Room", back_populates="messages")
+
+    __table_args__ = (
+        # room history pagination and the newest-first search queries (a btree
+        # scans backwards, so no separate DESC copy); partial so soft-deleted
+        # rows don't bloat it
+        Index(
+            "ix_messages_room_created_active", "room_id", "created_at",
+            postgresql_where=text("is_deleted = false"),
+        ),
+        # keyword search
+        Index(
+            "ix_messages_search", search_vector(content, transcription),
+            postgresql_using="gin",
+        ),
+    )
+
+
+message_search_vector = search_vector(Message.content, Message.transcription)
+
+
+class MessageHiddenFor(Base):
+    """A message a user has deleted "for me" only."""
+    __tablename__ = "message_hidden_for"
+
+    message_id = Column(UUID(as_uuid=True), ForeignKey("messages.id", ondelete="CASCADE"), primary_key=True)
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
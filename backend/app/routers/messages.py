@@ -1,10 +1,16 @@
 import os
 import uuid
 import asyncio
+import contextlib
+import itertools
+import aiofiles
+from datetime import datetime, timezone
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, BackgroundTasks, Query
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, and_, or_
+from sqlalchemy import select, insert, update, literal, and_, or_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.orm import selectinload
+from sqlalchemy.orm.attributes import set_committed_value
 from app.database import get_db
 from app import models, schemas
 from app.auth import get_current_user
@@ -15,6 +21,10 @@ from app.websocket import broadcast_message
 router = APIRouter(prefix="/api/rooms", tags=["messages"])
 settings = get_settings()
 
+UPLOAD_CHUNK_SIZE = 1 << 20  # 1 MiB
+SENTENCE_BATCH_SIZE = 128
+TRANSCRIPTION_MAX_CHARS = 4000  # document text kept on the message for keyword search
+
 
 async def _check_membership(db, room_id, user_id):
     result = await db.execute(
@@ -29,6 +39,65 @@ async def _check_membership(db, room_id, user_id):
         raise HTTPException(status_code=403, detail="Not a member of this room")
 
 
+async def _save_upload(file: UploadFile, file_path: str):
+    """Stream an upload to disk in chunks without blocking the event loop."""
+    async with aiofiles.open(file_path, "wb") as f:
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            await f.write(chunk)
+
+
+def _discard_upload(file_path: str):
+    """Remove a partially or fully written upload; it may not exist yet."""
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(file_path)
+
+
+def _attach_sender(message: models.Message, sender: models.User) -> models.Message:
+    """Populate message.sender from the already-loaded user instead of re-querying.
+
+    set_committed_value avoids a lazy load (not allowed under asyncio) and
+    doesn't cascade the user into this session.
+    """
+    set_committed_value(message, "sender", sender)
+    return message
+
+
+async def _insert_message(db, room_id, sender: models.User, **values) -> models.Message:
+    """Insert a message from ``sender``, but only if they're a member of the room.
+
+    Runs as a single INSERT ... SELECT ... WHERE EXISTS (membership) RETURNING,
+    so there's no separate membership round-trip and no gap between the
+    check and the write. Raises 403 if nothing was inserted.
+    """
+    values = {
+        "id": uuid.uuid4(),
+        "room_id": room_id,
+        "sender_id": sender.id,
+        "created_at": datetime.now(timezone.utc),
+        "is_transcribed": False,
+        "is_deleted": False,
+        **values,
+    }
+    columns = models.Message.__table__.c
+    is_member = (
+        select(models.RoomMember.id)
+        .where(
+            models.RoomMember.room_id == room_id,
+            models.RoomMember.user_id == sender.id,
+        )
+        .exists()
+    )
+    row = select(*(literal(v, columns[k].type) for k, v in values.items())).where(is_member)
+    result = await db.execute(
+        insert(models.Message).from_select(list(values), row).returning(models.Message)
+    )
+    message = result.scalar_one_or_none()
+    if message is None:
+        raise HTTPException(status_code=403, detail="Not a member of this room")
+    await db.commit()
+    return _attach_sender(message, sender)
+
+
 @router.post("/{room_id}/messages", response_model=schemas.MessageOut)
 async def send_text_message(
     room_id: uuid.UUID,
@@ -36,32 +105,18 @@ async def send_text_message(
     db: AsyncSession = Depends(get_db),
     current_user: models.User = Depends(get_current_user),
 ):
-    await _check_membership(db, room_id, current_user.id)
-
-    message = models.Message(
-        room_id=room_id,
-        sender_id=current_user.id,
+    message = await _insert_message(
+        db, room_id, current_user,
         content=data.content,
         message_type=models.MessageType.text,
     )
-    db.add(message)
-    await db.commit()
-    await db.refresh(message)
-
-    # Load sender relation
-    result = await db.execute(
-        select(models.Message)
-        .options(selectinload(models.Message.sender))
-        .where(models.Message.id == message.id)
-    )
-    message = result.scalar_one()
 
-    # Add to FAISS index
-    search_index.add_embedding(str(message.id), data.content)
+    # Queue for FAISS indexing (done by the background embedding worker)
+    search_index.enqueue_embedding(message.id, data.content)
 
     # Broadcast via WebSocket
     msg_out = schemas.MessageOut.model_validate(message)
-    await broadcast_message(str(room_id), msg_out.model_dump(mode="json"))
+    await broadcast_message(str(room_id), msg_out.model_dump_json())
 
     return message
 
@@ -84,7 +139,7 @@ async def _process_voice(message_id: str, file_path: str, room_id: str, db_sessi
                 await db.refresh(message)
 
                 # Index the transcription text
-                search_index.add_embedding(str(message.id), transcription)
+                search_index.enqueue_embedding(message.id, transcription)
 
                 # Broadcast update so frontend shows transcription
                 msg_out = schemas.MessageOut.model_validate(message)
@@ -105,8 +160,6 @@ async def send_attachment(
     db: AsyncSession = Depends(get_db),
     current_user: models.User = Depends(get_current_user),
 ):
-    await _check_membership(db, room_id, current_user.id)
-
     # Validate message type
     if message_type not in [models.MessageType.image, models.MessageType.video, models.MessageType.document]:
         raise HTTPException(status_code=400, detail="Invalid attachment type")
@@ -119,40 +172,32 @@ async def send_attachment(
     }
     subfolder = folder_map.get(message_type, "misc")
     upload_dir = os.path.join(settings.upload_dir, subfolder)
-    os.makedirs(upload_dir, exist_ok=True)
-    
+
     ext = os.path.splitext(file.filename or "file")[1]
     filename = f"{uuid.uuid4()}{ext}"
     file_path = os.path.join(upload_dir, filename)
 
-    content = await file.read()
-    with open(file_path, "wb") as f:
-        f.write(content)
-
     file_url = f"/uploads/{subfolder}/{filename}"
 
-    message = models.Message(
-        room_id=room_id,
-        sender_id=current_user.id,
-        content=file.filename, # For docs/videos, content can be the filename
-        message_type=message_type,
-        file_path=file_path,
-        file_url=file_url,
-    )
-    db.add(message)
-    await db.commit()
-    await db.refresh(message)
-
-    result = await db.execute(
-        select(models.Message)
-        .options(selectinload(models.Message.sender))
-        .where(models.Message.id == message.id)
-    )
-    message = result.scalar_one()
+    # Reject non-members before anything is written to disk
+    await _check_membership(db, room_id, current_user.id)
+    try:
+        await _save_upload(file, file_path)
+        message = await _insert_message(
+            db, room_id, current_user,
+            content=file.filename, # For docs/videos, content can be the filename
+            message_type=message_type,
+            file_path=file_path,
+            file_url=file_url,
+        )
+    except BaseException:
+        # Any failure (403, DB error, cancelled upload) must not leave an orphan
+        _discard_upload(file_path)
+        raise
 
     # Broadcast
     msg_out = schemas.MessageOut.model_validate(message)
-    await broadcast_message(str(room_id), msg_out.model_dump(mode="json"))
+    await broadcast_message(str(room_id), msg_out.model_dump_json())
 
     # For documents: extract text + index sentences in background
     if message_type == models.MessageType.document:
@@ -173,17 +218,40 @@ async def _process_document(message_id: str, file_path: str, room_id: str, db_se
     from app.services import document_service
     async with db_session_factory() as db:
         try:
-            # Extract text
-            text = document_service.extract_text(file_path)
+            # Stream the text page by page into the sentence splitter, keeping
+            # only its head for keyword search, and index a batch at a time
+            head = []
+            head_len = 0
+
+            def keep_head(chunks):
+                nonlocal head_len
+                for chunk in chunks:
+                    if head_len < TRANSCRIPTION_MAX_CHARS:
+                        head.append(chunk[:TRANSCRIPTION_MAX_CHARS - head_len])
+                        head_len += len(head[-1])
+                    yield chunk
+
+            sentences = document_service.iter_sentences_stream(
+                keep_head(document_service.iter_text(file_path))
+            )
+
+            def index_next_batch() -> int:
+                # Pulls the next pages and indexes them; both block, so off the event loop
+                batch = list(itertools.islice(sentences, SENTENCE_BATCH_SIZE))
+                if batch:
+                    search_index.add_document_sentences(message_id, batch)
+                return len(batch)
+
+            sentence_count = 0
+            while indexed := await asyncio.to_thread(index_next_batch):
+                sentence_count += indexed
+
+            text = "\n".join(head)[:TRANSCRIPTION_MAX_CHARS]
             if not text.strip():
                 print(f"[DocIndex] No text extracted from {file_path}")
                 return
 
-            # Split into sentences and index
-            sentences = document_service.split_sentences(text)
-            search_index.add_document_sentences(message_id, sentences)
-
-            # Store full text as transcription for keyword search
+            # Store the leading text as transcription for keyword search
             result = await db.execute(
                 select(models.Message)
                 .options(selectinload(models.Message.sender))
@@ -191,7 +259,7 @@ async def _process_document(message_id: str, file_path: str, room_id: str, db_se
             )
             message = result.scalar_one_or_none()
             if message:
-                message.transcription = text[:4000]   # cap to avoid huge DB values
+                message.transcription = text   # capped to avoid huge DB values
                 message.is_transcribed = True
                 await db.commit()
                 await db.refresh(message)
@@ -202,7 +270,7 @@ async def _process_document(message_id: str, file_path: str, room_id: str, db_se
                     "type": "transcription_update",
                     "message": msg_out.model_dump(mode="json"),
                 })
-                print(f"[DocIndex] Indexed {len(sentences)} sentences for message {message_id}")
+                print(f"[DocIndex] Indexed {sentence_count} sentences for message {message_id}")
         except Exception as e:
             print(f"[DocIndex] Error processing document {message_id}: {e}")
 
@@ -215,44 +283,34 @@ async def send_voice_message(
     db: AsyncSession = Depends(get_db),
     current_user: models.User = Depends(get_current_user),
 ):
-    await _check_membership(db, room_id, current_user.id)
-
     # Save file
     upload_dir = os.path.join(settings.upload_dir, "voice")
-    os.makedirs(upload_dir, exist_ok=True)
     ext = os.path.splitext(file.filename or "audio.webm")[1] or ".webm"
     filename = f"{uuid.uuid4()}{ext}"
     file_path = os.path.join(upload_dir, filename)
 
-    content = await file.read()
-    with open(file_path, "wb") as f:
-        f.write(content)
-
     file_url = f"/uploads/voice/{filename}"
 
-    message = models.Message(
-        room_id=room_id,
-        sender_id=current_user.id,
-        content=None,
-        message_type=models.MessageType.voice,
-        file_path=file_path,
-        file_url=file_url,
-        is_transcribed=False,
-    )
-    db.add(message)
-    await db.commit()
-    await db.refresh(message)
-
-    result = await db.execute(
-        select(models.Message)
-        .options(selectinload(models.Message.sender))
-        .where(models.Message.id == message.id)
-    )
-    message = result.scalar_one()
+    # Reject non-members before anything is written to disk
+    await _check_membership(db, room_id, current_user.id)
+    try:
+        await _save_upload(file, file_path)
+        message = await _insert_message(
+            db, room_id, current_user,
+            content=None,
+            message_type=models.MessageType.voice,
+            file_path=file_path,
+            file_url=file_url,
+            is_transcribed=False,
+        )
+    except BaseException:
+        # Any failure (403, DB error, cancelled upload) must not leave an orphan
+        _discard_upload(file_path)
+        raise
 
     # Broadcast immediately (without transcription)
     msg_out = schemas.MessageOut.model_validate(message)
-    await broadcast_message(str(room_id), msg_out.model_dump(mode="json"))
+    await broadcast_message(str(room_id), msg_out.model_dump_json())
 
     # Schedule transcription in background
     from app.database import AsyncSessionLocal
@@ -277,20 +335,21 @@ async def delete_message(
 ):
     await _check_membership(db, room_id, current_user.id)
 
-    result = await db.execute(
-        select(models.Message).where(
-            and_(models.Message.id == message_id, models.Message.room_id == room_id)
-        )
-    )
-    message = result.scalar_one_or_none()
-    if not message:
-        raise HTTPException(status_code=404, detail="Message not found")
+    in_room = and_(models.Message.id == message_id, models.Message.room_id == room_id)
 
     if scope == "everyone":
-        if str(message.sender_id) != str(current_user.id):
+        # Sender check and soft delete in one statement
+        result = await db.execute(
+            update(models.Message)
+            .where(in_room, models.Message.sender_id == current_user.id)
+            .values(is_deleted=True, content=None)
+            .returning(models.Message.id)
+            .execution_options(synchronize_session=False)
+        )
+        if result.scalar_one_or_none() is None:
+            if await db.scalar(select(models.Message.id).where(in_room)) is None:
+                raise HTTPException(status_code=404, detail="Message not found")
             raise HTTPException(status_code=403, detail="Only the sender can delete for everyone")
-        message.is_deleted = True
-        message.content = None
         await db.commit()
         await broadcast_message(str(room_id), {
             "type": "message_deleted",
@@ -298,12 +357,14 @@ async def delete_message(
             "scope": "everyone",
         })
     else:
-        # Delete for me: store as comma-separated user IDs in deleted_for column
-        deleted_for_raw = message.deleted_for or ""
-        deleted_for = set(deleted_for_raw.split(",")) if deleted_for_raw else set()
-        deleted_for.discard("")
-        deleted_for.add(str(current_user.id))
-        message.deleted_for = ",".join(deleted_for)
+        if await db.scalar(select(models.Message.id).where(in_room)) is None:
+            raise HTTPException(status_code=404, detail="Message not found")
+        # Delete for me: one row per (message, user); repeats are no-ops
+        await db.execute(
+            pg_insert(models.MessageHiddenFor)
+            .values(message_id=message_id, user_id=current_user.id)
+            .on_conflict_do_nothing()
+        )
         await db.commit()
 
     return {"status": "ok"}
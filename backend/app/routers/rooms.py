@@ -1,12 +1,13 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Response
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, and_, or_
-from sqlalchemy.orm import selectinload
+from sqlalchemy import select, insert, delete, func, text, and_, or_
+from sqlalchemy.orm import aliased, selectinload
 from typing import List, Optional
 import uuid
 from app.database import get_db
 from app import models, schemas
 from app.auth import get_current_user
+from app.services import membership_cache
 
 router = APIRouter(prefix="/api/rooms", tags=["rooms"])
 
@@ -16,52 +17,73 @@ async def _room_with_relations(db: AsyncSession, room_id: uuid.UUID):
         select(models.Room)
         .options(
             selectinload(models.Room.members).selectinload(models.RoomMember.user),
-            selectinload(models.Room.messages).selectinload(models.Message.sender),
         )
         .where(models.Room.id == room_id)
     )
     return result.scalar_one_or_none()
 
 
+def _user_json(alias: str) -> str:
+    return (
+        f"json_build_object('id', {alias}.id, 'username', {alias}.username, "
+        f"'email', {alias}.email, 'avatar_url', {alias}.avatar_url, "
+        f"'about', {alias}.about, 'is_online', coalesce({alias}.is_online, false), "
+        f"'created_at', {alias}.created_at)"
+    )
+
+
+# Builds the whole room list (members + last message) as one JSON document,
+# shaped like List[schemas.RoomOut], so no ORM objects are hydrated for it.
+_LIST_ROOMS_SQL = text(f"""
+SELECT coalesce(json_agg(room_out ORDER BY room_created_at DESC), '[]'::json)::text
+FROM (
+    SELECT
+        r.created_at AS room_created_at,
+        json_build_object(
+            'id', r.id,
+            'name', CASE WHEN r.is_group THEN r.name ELSE coalesce((
+                SELECT u.username FROM room_members om JOIN users u ON u.id = om.user_id
+                WHERE om.room_id = r.id AND om.user_id <> :uid LIMIT 1
+            ), r.name) END,
+            'is_group', coalesce(r.is_group, false),
+            'created_at', r.created_at,
+            'members', (
+                SELECT coalesce(json_agg({_user_json("u")}), '[]'::json)
+                FROM room_members mm JOIN users u ON u.id = mm.user_id
+                WHERE mm.room_id = r.id
+            ),
+            'last_message', (
+                SELECT json_build_object(
+                    'id', m.id, 'room_id', m.room_id, 'sender_id', m.sender_id,
+                    'content', m.content, 'message_type', m.message_type,
+                    'file_url', m.file_url, 'transcription', m.transcription,
+                    'is_transcribed', coalesce(m.is_transcribed, false),
+                    'is_deleted', coalesce(m.is_deleted, false),
+                    'created_at', m.created_at,
+                    'sender', {_user_json("s")}
+                )
+                FROM messages m JOIN users s ON s.id = m.sender_id
+                WHERE m.room_id = r.id AND m.is_deleted = false
+                ORDER BY m.created_at DESC
+                LIMIT 1
+            )
+        ) AS room_out
+    FROM rooms r
+    JOIN room_members rm ON rm.room_id = r.id
+    WHERE rm.user_id = :uid
+) rooms_out
+""")
+
+
 @router.get("", response_model=List[schemas.RoomOut])
 async def list_rooms(
     db: AsyncSession = Depends(get_db),
     current_user: models.User = Depends(get_current_user),
 ):
-    result = await db.execute(
-        select(models.Room)
-        .join(models.RoomMember, models.RoomMember.room_id == models.Room.id)
-        .where(models.RoomMember.user_id == current_user.id)
-        .options(
-            selectinload(models.Room.members).selectinload(models.RoomMember.user),
-            selectinload(models.Room.messages).selectinload(models.Message.sender),
-        )
-        .order_by(models.Room.created_at.desc())
-    )
-    rooms = result.scalars().unique().all()
-
-    out = []
-    for room in rooms:
-        members_out = [schemas.UserOut.model_validate(m.user) for m in room.members]
-        last_msg = None
-        if room.messages:
-            msg = sorted(room.messages, key=lambda m: m.created_at)[-1]
-            last_msg = schemas.MessageOut.model_validate(msg)
-        # For DMs, name is the other person's username
-        name = room.name
-        if not room.is_group:
-            other = next((m.user for m in room.members if m.user_id != current_user.id), None)
-            if other:
-                name = other.username
-        out.append(schemas.RoomOut(
-            id=room.id,
-            name=name,
-            is_group=room.is_group,
-            created_at=room.created_at,
-            members=members_out,
-            last_message=last_msg,
-        ))
-    return out
+    # For DMs, name is the other person's username (resolved in SQL).
+    # Returning a Response skips re-validating the rows against response_model.
+    result = await db.execute(_LIST_ROOMS_SQL, {"uid": current_user.id})
+    return Response(content=result.scalar_one(), media_type="application/json")
 
 
 @router.post("", response_model=schemas.RoomOut)
@@ -71,29 +93,29 @@ async def create_room(
     current_user: models.User = Depends(get_current_user),
 ):
     # For DMs: check if room already exists
-    if not data.is_group and len(data.member_ids) == 1:
+    if not data.is_group and len(data.member_ids) == 1 and data.member_ids[0] != current_user.id:
         other_id = data.member_ids[0]
+        mine = aliased(models.RoomMember)
+        theirs = aliased(models.RoomMember)
         existing = await db.execute(
             select(models.Room)
-            .join(models.RoomMember, models.RoomMember.room_id == models.Room.id)
-            .where(
-                models.Room.is_group == False,
-                models.RoomMember.user_id == current_user.id,
-            )
+            .join(mine, and_(mine.room_id == models.Room.id, mine.user_id == current_user.id))
+            .join(theirs, and_(theirs.room_id == models.Room.id, theirs.user_id == other_id))
+            .where(models.Room.is_group == False)
+            .options(selectinload(models.Room.members).selectinload(models.RoomMember.user))
+            .limit(1)
         )
-        for room in existing.scalars().unique().all():
-            member_ids = {str(m.user_id) for m in room.members}
-            if str(other_id) in member_ids and str(current_user.id) in member_ids:
-                full = await _room_with_relations(db, room.id)
-                members_out = [schemas.UserOut.model_validate(m.user) for m in full.members]
-                other = next((m.user for m in full.members if m.user_id != current_user.id), None)
-                return schemas.RoomOut(
-                    id=full.id,
-                    name=other.username if other else full.name,
-                    is_group=full.is_group,
-                    created_at=full.created_at,
-                    members=members_out,
-                )
+        full = existing.scalar_one_or_none()
+        if full is not None:
+            members_out = [schemas.UserOut.model_validate(m.user) for m in full.members]
+            other = next((m.user for m in full.members if m.user_id != current_user.id), None)
+            return schemas.RoomOut(
+                id=full.id,
+                name=other.username if other else full.name,
+                is_group=full.is_group,
+                created_at=full.created_at,
+                members=members_out,
+            )
 
     room = models.Room(
         name=data.name,
@@ -104,15 +126,16 @@ async def create_room(
     await db.flush()
 
     all_member_ids = list(set(data.member_ids + [current_user.id]))
-    for uid in all_member_ids:
-        member = models.RoomMember(
-            room_id=room.id,
-            user_id=uid,
-            is_admin=(uid == current_user.id),
-        )
-        db.add(member)
+    await db.execute(
+        insert(models.RoomMember),
+        [
+            {"room_id": room.id, "user_id": uid, "is_admin": uid == current_user.id}
+            for uid in all_member_ids
+        ],
+    )
 
     await db.commit()
+    membership_cache.invalidate(*all_member_ids)
     full = await _room_with_relations(db, room.id)
     members_out = [schemas.UserOut.model_validate(m.user) for m in full.members]
     other = next((m.user for m in full.members if m.user_id != current_user.id), None)
@@ -150,7 +173,13 @@ async def get_messages(
         select(models.Message)
         .options(selectinload(models.Message.sender))
         .where(
-            and_(models.Message.room_id == room_id, models.Message.is_deleted == False)
+            and_(models.Message.room_id == room_id, models.Message.is_deleted == False),
+            ~select(models.MessageHiddenFor.message_id)
+            .where(
+                models.MessageHiddenFor.message_id == models.Message.id,
+                models.MessageHiddenFor.user_id == current_user.id,
+            )
+            .exists(),
         )
         .order_by(models.Message.created_at.asc())
         .limit(limit)
@@ -168,7 +197,6 @@ async def leave_or_delete_room(
     """
     Leave a room (1-on-1 DMs: delete entirely; groups: just remove self).
     """
-    from sqlalchemy import text
 
     # Verify membership
     membership_result = await db.execute(
@@ -184,14 +212,22 @@ async def leave_or_delete_room(
 
     # Count members
     count_result = await db.execute(
-        select(models.RoomMember).where(models.RoomMember.room_id == room_id)
+        select(func.count())
+        .select_from(models.RoomMember)
+        .where(models.RoomMember.room_id == room_id)
     )
-    members = count_result.scalars().all()
-
-    if len(members) <= 2:
-        # Delete entire room — use raw SQL in correct FK order
-        await db.execute(text("DELETE FROM messages WHERE room_id = :rid"), {"rid": room_id})
-        await db.execute(text("DELETE FROM room_members WHERE room_id = :rid"), {"rid": room_id})
+    member_count = count_result.scalar()
+
+    if member_count <= 2:
+        # Delete entire room — messages go with it via ON DELETE CASCADE; the
+        # members are deleted explicitly to learn whose room lists changed
+        member_result = await db.execute(
+            delete(models.RoomMember)
+            .where(models.RoomMember.room_id == room_id)
+            .returning(models.RoomMember.user_id)
+            .execution_options(synchronize_session=False)
+        )
+        left_ids = member_result.scalars().all()
         await db.execute(text("DELETE FROM rooms WHERE id = :rid"), {"rid": room_id})
     else:
         # Just remove self from group
@@ -199,6 +235,8 @@ async def leave_or_delete_room(
             text("DELETE FROM room_members WHERE room_id = :rid AND user_id = :uid"),
             {"rid": room_id, "uid": current_user.id},
         )
+        left_ids = [current_user.id]
 
     await db.commit()
+    membership_cache.invalidate(*left_ids)
     return {"status": "ok"}
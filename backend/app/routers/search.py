@@ -1,16 +1,29 @@
 from fastapi import APIRouter, Depends, Query
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, and_, or_
-from sqlalchemy.orm import selectinload
-from typing import Optional
+from sqlalchemy import select, values, column, func, Integer, String, and_
+from sqlalchemy.dialects.postgresql import UUID as PG_UUID
+from typing import Optional, Tuple
+import asyncio
+import itertools
+import re
 import uuid
 from app.database import get_db
 from app import models, schemas
 from app.auth import get_current_user
-from app.services import search_index
+from app.services import membership_cache, search_index
 
 router = APIRouter(prefix="/api", tags=["search"])
 
+# Search loads plain rows (message columns + its sender's, prefixed "sender__"
+# so users.id can't clash with messages.sender_id) rather than ORM objects;
+# the columns follow the response schemas.
+_SENDER_PREFIX = "sender__"
+_MESSAGE_FIELDS = [f for f in schemas.MessageOut.model_fields if f != "sender"]
+_SENDER_FIELDS = list(schemas.UserOut.model_fields)
+_RESULT_COLUMNS = [getattr(models.Message, f) for f in _MESSAGE_FIELDS] + [
+    getattr(models.User, f).label(_SENDER_PREFIX + f) for f in _SENDER_FIELDS
+]
+
 
 @router.get("/search", response_model=schemas.SearchResponse)
 async def search_messages(
@@ -23,12 +36,7 @@ async def search_messages(
         return schemas.SearchResponse(query=q, results=[], total=0)
 
     # Get rooms user is a member of
-    rooms_result = await db.execute(
-        select(models.RoomMember.room_id).where(
-            models.RoomMember.user_id == current_user.id
-        )
-    )
-    user_room_ids = [r[0] for r in rooms_result.fetchall()]
+    user_room_ids = await membership_cache.get_room_ids(db, current_user.id)
 
     if not user_room_ids:
         return schemas.SearchResponse(query=q, results=[], total=0)
@@ -41,128 +49,122 @@ async def search_messages(
         base_conditions.append(models.Message.room_id == room_id)
 
     # ── 1. Keyword search (text content + transcription) ─────────────────────
-    keyword_filter = or_(
-        models.Message.content.ilike(f"%{q}%"),
-        models.Message.transcription.ilike(f"%{q}%"),
+    # Full-text match, answered from the ix_messages_search GIN index
+    keyword_filter = models.message_search_vector.op("@@")(
+        func.plainto_tsquery(models.SEARCH_CONFIG, q)
     )
     keyword_result = await db.execute(
-        select(models.Message)
-        .options(selectinload(models.Message.sender))
+        select(*_RESULT_COLUMNS)
+        .join(models.User, models.User.id == models.Message.sender_id)
         .where(and_(*base_conditions, keyword_filter))
         .order_by(models.Message.created_at.desc())
         .limit(30)
     )
-    keyword_messages = keyword_result.scalars().all()
+    keyword_messages = keyword_result.all()
+
+    # Embed the query once for both FAISS indexes
+    query_vec = await asyncio.to_thread(search_index.encode_query, q)
 
     # ── 2. Semantic search via FAISS (message-level) ──────────────────────────
-    semantic_ids = search_index.search(q, top_k=20)
-    semantic_messages = []
-    if semantic_ids:
-        sem_result = await db.execute(
-            select(models.Message)
-            .options(selectinload(models.Message.sender))
-            .where(and_(
-                *base_conditions,
-                models.Message.id.in_([uuid.UUID(mid) for mid in semantic_ids if _is_valid_uuid(mid)]),
-            ))
-        )
-        semantic_messages = sem_result.scalars().all()
+    semantic_ids = await search_index.search_batched(q, top_k=20, query_vec=query_vec)
 
     # ── 3. Sentence-level search via FAISS (documents) ────────────────────────
-    sentence_hits = search_index.search_sentences(q, top_k=10)
-    sentence_message_ids = list({h["message_id"] for h in sentence_hits if _is_valid_uuid(h["message_id"])})
-    sentence_snippet_map = {}  # message_id → best sentence
+    # Off the event loop: it may wait on the sentence index's write lock
+    sentence_hits = await asyncio.to_thread(
+        search_index.search_sentences, q, top_k=10, query_vec=query_vec
+    )
+    sentence_snippet_map = {}  # message UUID → best sentence
     for h in sentence_hits:
         mid = h["message_id"]
         if mid not in sentence_snippet_map:
             sentence_snippet_map[mid] = h["sentence"]
 
+    # Fetch both FAISS hit lists in one round-trip: join messages against a
+    # VALUES (id, rank, source) list and let Postgres filter and order them.
+    hit_rows = [
+        (mid, rank, source)
+        for rank, (mid, source) in enumerate(
+            [(mid, "semantic") for mid in semantic_ids]
+            + [(mid, "document") for mid in sentence_snippet_map]
+        )
+    ]
+    semantic_messages = []
     sentence_messages = []
-    if sentence_message_ids:
-        sent_result = await db.execute(
-            select(models.Message)
-            .options(selectinload(models.Message.sender))
-            .where(and_(
-                *base_conditions,
-                models.Message.id.in_([uuid.UUID(mid) for mid in sentence_message_ids]),
-            ))
+    if hit_rows:
+        hits = values(
+            column("id", PG_UUID(as_uuid=True)),
+            column("rank", Integer),
+            column("source", String),
+            name="hits",
+        ).data(hit_rows)
+        hits_result = await db.execute(
+            select(*_RESULT_COLUMNS, hits.c.source)
+            .join(hits, hits.c.id == models.Message.id)
+            .join(models.User, models.User.id == models.Message.sender_id)
+            .where(and_(*base_conditions))
+            .order_by(hits.c.rank)
         )
-        sentence_messages = sent_result.scalars().all()
+        for row in hits_result.all():
+            (semantic_messages if row.source == "semantic" else sentence_messages).append(row)
 
     # ── 4. Merge results ──────────────────────────────────────────────────────
-    seen_ids = set()
-    results = []
+    # Case-insensitive matcher compiled once, so snippets don't lowercase every text
+    pattern = re.compile(re.escape(q), re.IGNORECASE)
+
+    # Fold every candidate into one entry per message, keeping its best-scoring source
+    candidates = itertools.chain(
+        zip(keyword_messages, itertools.repeat((1.0, "text"))),
+        zip(semantic_messages, itertools.repeat((0.8, "semantic"))),
+        zip(sentence_messages, itertools.repeat((0.75, "document"))),
+    )
+    best = {}  # message UUID → (msg, score, source)
+    for msg, (score, source) in candidates:
+        current = best.get(msg.id)
+        if current is None or score > current[1]:
+            best[msg.id] = (msg, score, source)
 
-    # Keyword hits first
-    for msg in keyword_messages:
-        if str(msg.id) in seen_ids:
-            continue
-        seen_ids.add(str(msg.id))
-        match_type = "text"
-        searchable = msg.content or ""
-        if msg.transcription and q.lower() in (msg.transcription or "").lower():
-            if msg.message_type == "document":
-                match_type = "document"
-                searchable = msg.transcription
-            else:
-                match_type = "transcription"
-                searchable = msg.transcription
-        snippet = _extract_snippet(searchable, q)
+    # Snippets are only extracted for the winning source
+    results = []
+    for msg, score, source in best.values():
+        match_type, snippet = _match_snippet(msg, source, pattern, sentence_snippet_map)
         results.append(schemas.SearchResult(
-            message=schemas.MessageOut.model_validate(msg),
+            message=_message_out(msg),
             snippet=snippet,
             match_type=match_type,
-            score=1.0,
+            score=score,
         ))
 
-    # Semantic message-level hits
-    for msg in semantic_messages:
-        if str(msg.id) in seen_ids:
-            continue
-        seen_ids.add(str(msg.id))
-        searchable = msg.transcription or msg.content or ""
-        snippet = _extract_snippet(searchable, q)
-        results.append(schemas.SearchResult(
-            message=schemas.MessageOut.model_validate(msg),
-            snippet=snippet,
-            match_type="semantic",
-            score=0.8,
-        ))
+    return schemas.SearchResponse(query=q, results=results, total=len(results))
 
-    # Sentence-level document hits
-    for msg in sentence_messages:
-        if str(msg.id) in seen_ids:
-            continue
-        seen_ids.add(str(msg.id))
-        best_sentence = sentence_snippet_map.get(str(msg.id), "")
-        snippet = _extract_snippet(best_sentence, q) if best_sentence else ""
-        results.append(schemas.SearchResult(
-            message=schemas.MessageOut.model_validate(msg),
-            snippet=snippet,
-            match_type="document",
-            score=0.75,
-        ))
 
-    return schemas.SearchResponse(query=q, results=results, total=len(results))
+def _message_out(row) -> schemas.MessageOut:
+    m = row._mapping
+    return schemas.MessageOut.model_validate({
+        **{f: m[f] for f in _MESSAGE_FIELDS},
+        "sender": {f: m[_SENDER_PREFIX + f] for f in _SENDER_FIELDS},
+    })
+
 
+def _match_snippet(msg, source: str, pattern: re.Pattern, sentence_snippet_map: dict) -> Tuple[str, str]:
+    """Return (match_type, snippet) for a message found through ``source``."""
+    if source == "text":
+        if msg.transcription and pattern.search(msg.transcription):
+            match_type = "document" if msg.message_type == "document" else "transcription"
+            return match_type, _extract_snippet(msg.transcription, pattern)
+        return "text", _extract_snippet(msg.content or "", pattern)
+    if source == "semantic":
+        return "semantic", _extract_snippet(msg.transcription or msg.content or "", pattern)
+    best_sentence = sentence_snippet_map.get(msg.id, "")
+    return "document", _extract_snippet(best_sentence, pattern) if best_sentence else ""
 
-def _extract_snippet(text: str, query: str, window: int = 80) -> str:
+
+def _extract_snippet(text: str, pattern: re.Pattern, window: int = 80) -> str:
     if not text:
         return ""
-    lower_text = text.lower()
-    lower_query = query.lower()
-    idx = lower_text.find(lower_query)
-    if idx == -1:
+    match = pattern.search(text)
+    if match is None:
         return text[:window * 2]
-    start = max(0, idx - window // 2)
-    end = min(len(text), idx + len(query) + window // 2)
+    start = max(0, match.start() - window // 2)
+    end = min(len(text), match.end() + window // 2)
     snippet = ("..." if start > 0 else "") + text[start:end] + ("..." if end < len(text) else "")
     return snippet
-
-
-def _is_valid_uuid(val: str) -> bool:
-    try:
-        uuid.UUID(val)
-        return True
-    except (ValueError, AttributeError):
-        return False
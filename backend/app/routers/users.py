@@ -4,7 +4,8 @@ from sqlalchemy import select, or_
 from app.database import get_db
 from app import models, schemas
 from app.auth import (
-    hash_password, verify_password, create_access_token, get_current_user
+    hash_password, verify_password, create_access_token, get_current_user,
+    invalidate_user_cache,
 )
 
 router = APIRouter(prefix="/api/auth", tags=["auth"])
@@ -26,7 +27,7 @@ async def register(data: schemas.UserCreate, db: AsyncSession = Depends(get_db))
     user = models.User(
         username=data.username,
         email=data.email,
-        hashed_password=hash_password(data.password),
+        hashed_password=await hash_password(data.password),
         avatar_url=data.avatar_url or f"https://api.dicebear.com/7.x/avataaars/svg?seed={data.username}",
     )
     db.add(user)
@@ -44,7 +45,7 @@ async def login(data: schemas.UserLogin, db: AsyncSession = Depends(get_db)):
     )
     user = result.scalar_one_or_none()
     
-    if not user or not verify_password(data.password, user.hashed_password):
+    if not user or not await verify_password(data.password, user.hashed_password):
         raise HTTPException(status_code=401, detail="Invalid email or password")
 
     token = create_access_token({"sub": str(user.id)})
@@ -62,16 +63,22 @@ async def update_profile(
     db: AsyncSession = Depends(get_db),
     current_user: models.User = Depends(get_current_user),
 ):
+    # current_user may be a cached snapshot; edit the live row so columns we
+    # don't touch (e.g. is_online) keep their current values
+    user = await db.get(models.User, current_user.id)
+    if user is None:
+        raise HTTPException(status_code=404, detail="User not found")
     if data.username:
-        current_user.username = data.username
+        user.username = data.username
     if data.avatar_url:
-        current_user.avatar_url = data.avatar_url
+        user.avatar_url = data.avatar_url
     if data.about:
-        current_user.about = data.about
+        user.about = data.about
     
     await db.commit()
-    await db.refresh(current_user)
-    return current_user
+    await db.refresh(user)
+    invalidate_user_cache(user.id)
+    return user
 
 
 @users_router.get("/search", response_model=list[schemas.UserOut])
@@ -79,7 +79,6 @@ class MessageOut(BaseModel):
     transcription: Optional[str] = None
     is_transcribed: bool = False
     is_deleted: bool = False
-    deleted_for: Optional[str] = None
     created_at: datetime
     sender: Optional[UserOut] = None
 
@@ -4,40 +4,43 @@ Supports PDF, DOCX, and TXT.
 """
 import os
 import re
-from typing import List
+from typing import Iterable, Iterator
 
+# Sentence-ending punctuation followed by whitespace, or a blank line
+_SENT_SPLIT = re.compile(r'(?<=[.!?])\s+|\n{2,}')
 
-def extract_text(file_path: str) -> str:
-    """Extract all text from a document file. Returns empty string on failure."""
+
+def iter_text(file_path: str) -> Iterator[str]:
+    """Yield a document's text piece by piece (page by page for PDFs).
+
+    Stops early, after logging, if extraction fails part-way through.
+    """
     ext = os.path.splitext(file_path)[1].lower()
     try:
         if ext == ".pdf":
-            return _extract_pdf(file_path)
+            yield from _iter_pdf_text(file_path)
         elif ext in (".docx", ".doc"):
-            return _extract_docx(file_path)
+            yield _extract_docx(file_path)
         elif ext in (".pptx", ".ppt"):
-            return _extract_pptx(file_path)
+            yield _extract_pptx(file_path)
         elif ext == ".txt":
             with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
-                return f.read()
+                yield f.read()
         else:
             # Try reading as plain text for unknown types
             with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
-                return f.read()
+                yield f.read()
     except Exception as e:
         print(f"[DocService] Failed to extract text from {file_path}: {e}")
-        return ""
 
 
-def _extract_pdf(file_path: str) -> str:
+def _iter_pdf_text(file_path: str) -> Iterator[str]:
     from pypdf import PdfReader
     reader = PdfReader(file_path)
-    pages = []
     for page in reader.pages:
         text = page.extract_text()
         if text:
-            pages.append(text)
-    return "\n".join(pages)
+            yield text
 
 
 def _extract_docx(file_path: str) -> str:
@@ -57,15 +60,23 @@ def _extract_pptx(file_path: str) -> str:
     return "\n".join(text_runs)
 
 
-def split_sentences(text: str, min_len: int = 15) -> List[str]:
-    """Split text into sentences; discard very short fragments."""
-    if not text:
-        return []
-    # Split on sentence-ending punctuation or newlines
-    raw = re.split(r'(?<=[.!?])\s+|\n{2,}', text)
-    sentences = []
-    for s in raw:
-        s = s.strip()
+def iter_sentences_stream(chunks: Iterable[str], min_len: int = 15) -> Iterator[str]:
+    """Yield the sentences of "\n".join(chunks) without building the joined text.
+
+    The unfinished sentence at the end of each chunk is carried over and
+    completed by the next one; very short fragments are discarded.
+    """
+    tail = None
+    for chunk in chunks:
+        buf = chunk if tail is None else tail + "\n" + chunk
+        pos = 0
+        for m in _SENT_SPLIT.finditer(buf):
+            s = buf[pos:m.start()].strip()
+            pos = m.end()
+            if len(s) >= min_len:
+                yield s
+        tail = buf[pos:]
+    if tail:
+        s = tail.strip()
         if len(s) >= min_len:
-            sentences.append(s)
-    return sentences
+            yield s
@@ -0,0 +1,31 @@
+"""
+membership_cache.py — Short-lived cache of which rooms each user belongs to.
+Used by search to skip the room_members lookup on every request.
+"""
+import uuid
+from typing import List
+from cachetools import TTLCache
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app import models
+
+# user_id → room ids; the TTL bounds staleness across worker processes,
+# which don't see each other's invalidations
+_room_ids: TTLCache = TTLCache(maxsize=10_000, ttl=60)
+
+
+async def get_room_ids(db: AsyncSession, user_id: uuid.UUID) -> List[uuid.UUID]:
+    """Return the ids of the rooms ``user_id`` is a member of."""
+    room_ids = _room_ids.get(user_id)
+    if room_ids is None:
+        result = await db.execute(
+            select(models.RoomMember.room_id).where(models.RoomMember.user_id == user_id)
+        )
+        room_ids = _room_ids[user_id] = list(result.scalars())
+    return room_ids
+
+
+def invalidate(*user_ids: uuid.UUID):
+    """Drop cached room lists; call whenever these users join or leave a room."""
+    for user_id in user_ids:
+        _room_ids.pop(user_id, None)
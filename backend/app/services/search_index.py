@@ -1,174 +1,501 @@
 import os
-import json
+import time
+import uuid
+import atexit
+import asyncio
 import threading
 import numpy as np
-from typing import List, Dict
+import orjson
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Hashable, List, Dict, Optional, Tuple, Union
 from app.config import get_settings
 
 settings = get_settings()
 
 # ─── Message-level index (existing) ──────────────────────────────────────────
 _index = None
-_id_map: List[str] = []   # position → message_id
+_id_map: List[uuid.UUID] = []   # position → message_id
 
 # ─── Sentence-level index (new) ──────────────────────────────────────────────
 _sent_index = None
 _sent_map: List[Dict] = []   # position → {message_id, sentence}
 
 _model = None
-_lock = threading.Lock()
 EMBEDDING_DIM = 384  # all-MiniLM-L6-v2 output dim
 
+# HNSW graph over fp16-quantized vectors (half the bytes scanned per distance);
+# embeddings are L2-normalized so inner product == cosine
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
+
+# Pending (message_id, text) pairs; created by run_embedding_worker()
+_embed_queue: Optional[asyncio.Queue] = None
+EMBED_BATCH_SIZE = 32
+
+# Concurrent search() calls are coalesced for this long into one FAISS call
+_search_queue: Optional[asyncio.Queue] = None
+SEARCH_FLUSH_MS = 10
+SEARCH_MAX_BATCH = 64
+
+# Inserts only mark the indexes dirty; run_persistence_loop() writes them out
+_dirty = False
+_sent_dirty = False
+FLUSH_INTERVAL_SECONDS = 5
+
+
+class RWLock:
+    """Readers share the lock; a writer gets it alone.
+
+    Waiting writers hold off new readers, so a steady stream of searches
+    can't starve an insert.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writing = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writing or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writing or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writing = False
+                self._cond.notify_all()
+
+
+# Searches run concurrently; adds and saves have their index to themselves
+_index_lock = RWLock()
+_sent_lock = RWLock()
+
+
+class QueryCache:
+    """Thread-safe LRU cache whose entries also expire after ``ttl`` seconds."""
+
+    def __init__(self, max_size: int = 2000, ttl: float = 300.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.RLock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: Hashable, value: Any):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def invalidate_all(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
+
+
+# query text → embedding (only depends on the model, never invalidated)
+_embedding_cache = QueryCache()
+# (query, top_k) → message ids; cleared whenever the message index changes
+_result_cache = QueryCache()
+
 
 def _get_model():
     global _model
     if _model is None:
         from sentence_transformers import SentenceTransformer
         print(f"[FAISS] Loading embedding model: {settings.embedding_model}")
-        _model = SentenceTransformer(settings.embedding_model)
+        model = SentenceTransformer(settings.embedding_model)
+        if settings.embedding_int8 and model.device.type == "cpu":
+            # Dynamic int8 quantization of the Linear layers: ~4x smaller weights
+            # and VNNI/AVX2 int8 GEMMs on CPU, at a negligible cost in recall
+            import torch
+            model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+            print("[FAISS] Embedding model quantized to int8")
+        _model = model
         print("[FAISS] Embedding model loaded")
     return _model
 
 
 # ─── Persistence helpers ──────────────────────────────────────────────────────
 
-def _load_index():
-    global _index, _id_map, _sent_index, _sent_map
+def _new_index():
+    import faiss
+    index = faiss.IndexHNSWSQ(
+        EMBEDDING_DIM, faiss.ScalarQuantizer.QT_fp16, HNSW_M, faiss.METRIC_INNER_PRODUCT
+    )
+    index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    index.hnsw.efSearch = HNSW_EF_SEARCH
+    return index
+
+
+def _read_index(path: str):
+    """Read an index from disk, rebuilding older flat / fp32 HNSW indexes as HNSW-SQ fp16.
+
+    Returns ``(index, rebuilt)``; a rebuilt index still needs writing back.
+    """
     import faiss
+    index = faiss.read_index(path)
+    if isinstance(index, faiss.IndexHNSWSQ):
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+        return index, False
+    print(f"[FAISS] Rebuilding {path} ({index.ntotal} vectors) as HNSW-SQ fp16 index")
+    rebuilt = _new_index()
+    if index.ntotal:
+        rebuilt.add(index.reconstruct_n(0, index.ntotal))
+    return rebuilt, True
+
+
+def _load_index():
+    global _index, _id_map, _sent_index, _sent_map, _dirty, _sent_dirty
 
     # Message-level index
     if os.path.exists(settings.faiss_index_path) and os.path.exists(settings.faiss_id_map_path):
         print("[FAISS] Loading existing index from disk")
-        _index = faiss.read_index(settings.faiss_index_path)
-        with open(settings.faiss_id_map_path, "r") as f:
-            _id_map = json.load(f)
+        # A rebuilt index is marked dirty so the next flush persists it
+        _index, _dirty = _read_index(settings.faiss_index_path)
+        with open(settings.faiss_id_map_path, "rb") as f:
+            _id_map = [uuid.UUID(mid) for mid in orjson.loads(f.read())]
         print(f"[FAISS] Loaded index with {_index.ntotal} vectors")
     else:
-        print("[FAISS] Creating new flat L2 index")
-        _index = faiss.IndexFlatL2(EMBEDDING_DIM)
+        print("[FAISS] Creating new HNSW-SQ fp16 index")
+        _index = _new_index()
         _id_map = []
 
     # Sentence-level index
     if os.path.exists(settings.faiss_sentence_index_path) and os.path.exists(settings.faiss_sentence_map_path):
         print("[FAISS] Loading existing sentence index from disk")
-        _sent_index = faiss.read_index(settings.faiss_sentence_index_path)
-        with open(settings.faiss_sentence_map_path, "r") as f:
-            _sent_map = json.load(f)
+        _sent_index, _sent_dirty = _read_index(settings.faiss_sentence_index_path)
+        with open(settings.faiss_sentence_map_path, "rb") as f:
+            _sent_map = [
+                {"message_id": uuid.UUID(e["message_id"]), "sentence": e["sentence"]}
+                for e in orjson.loads(f.read())
+            ]
         print(f"[FAISS] Loaded sentence index with {_sent_index.ntotal} vectors")
     else:
         print("[FAISS] Creating new sentence index")
-        _sent_index = faiss.IndexFlatL2(EMBEDDING_DIM)
+        _sent_index = _new_index()
         _sent_map = []
 
 
+def _write_atomic(path: str, write):
+    """Write via a temp file + os.replace so a crash never leaves a truncated file."""
+    tmp_path = f"{path}.tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def _write_json(path: str, data):
+    # orjson writes UUIDs natively, so the maps are dumped as-is
+    payload = orjson.dumps(data)
+
+    def write(tmp_path):
+        with open(tmp_path, "wb") as f:
+            f.write(payload)
+    _write_atomic(path, write)
+
+
 def _save_index():
     import faiss
-    faiss.write_index(_index, settings.faiss_index_path)
-    with open(settings.faiss_id_map_path, "w") as f:
-        json.dump(_id_map, f)
+    global _dirty
+    with _index_lock.write():
+        _write_atomic(settings.faiss_index_path, lambda p: faiss.write_index(_index, p))
+        _write_json(settings.faiss_id_map_path, _id_map)
+        _dirty = False
 
 
 def _save_sent_index():
     import faiss
-    faiss.write_index(_sent_index, settings.faiss_sentence_index_path)
-    with open(settings.faiss_sentence_map_path, "w") as f:
-        json.dump(_sent_map, f)
+    global _sent_dirty
+    with _sent_lock.write():
+        _write_atomic(settings.faiss_sentence_index_path, lambda p: faiss.write_index(_sent_index, p))
+        _write_json(settings.faiss_sentence_map_path, _sent_map)
+        _sent_dirty = False
+
+
+def flush():
+    """Persist whichever indexes changed since the last flush."""
+    if _dirty and _index is not None:
+        _save_index()
+    if _sent_dirty and _sent_index is not None:
+        _save_sent_index()
+
+
+async def run_persistence_loop():
+    """Background task: flush dirty indexes to disk every FLUSH_INTERVAL_SECONDS."""
+    while True:
+        await asyncio.sleep(FLUSH_INTERVAL_SECONDS)
+        try:
+            await asyncio.to_thread(flush)
+        except Exception as e:
+            print(f"[FAISS] Failed to persist index: {e}")
+
+
+def _encode_queries(queries: List[str]) -> np.ndarray:
+    """Embed queries as a (len(queries), EMBEDDING_DIM) matrix; cached vectors skip the model."""
+    vecs = [_embedding_cache.get(q) for q in queries]
+    missing = list(dict.fromkeys(q for q, v in zip(queries, vecs) if v is None))
+    if missing:
+        encoded = _get_model().encode(missing, normalize_embeddings=True, show_progress_bar=False)
+        fresh = dict(zip(missing, np.array(encoded, dtype=np.float32)))
+        for q, v in fresh.items():
+            _embedding_cache.put(q, v)
+        vecs = [fresh[q] if v is None else v for q, v in zip(queries, vecs)]
+    return np.vstack(vecs).astype(np.float32)
+
+
+def encode_query(query: str) -> np.ndarray:
+    """Embed one query as an (EMBEDDING_DIM,) vector, reusing the cached one if any.
+
+    Compute this once per request and pass it as ``query_vec`` to both searches.
+    """
+    return _encode_queries([query])[0]
+
+
+def _as_uuid(message_id: Union[str, uuid.UUID]) -> uuid.UUID:
+    return message_id if isinstance(message_id, uuid.UUID) else uuid.UUID(message_id)
 
 
 def initialize():
     """Call once on app startup."""
     _load_index()
     _get_model()  # warm up model
+    atexit.register(flush)
 
 
 # ─── Message-level add / search (unchanged) ───────────────────────────────────
 
-def add_embedding(message_id: str, text: str):
+def add_embedding(message_id: Union[str, uuid.UUID], text: str):
     """Encode text and add to message-level FAISS index."""
+    add_embeddings_batch([(message_id, text)])
+
+
+def add_embeddings_batch(items: List[Tuple[Union[str, uuid.UUID], str]]):
+    """Encode several (message_id, text) pairs in one forward pass and index them."""
+    global _dirty
+    items = [(mid, text) for mid, text in items if text and text.strip()]
+    if not items:
+        return
+    try:
+        # Encode before taking the lock so searches keep running meanwhile
+        model = _get_model()
+        embeddings = model.encode(
+            [text for _, text in items], normalize_embeddings=True, show_progress_bar=False
+        )
+        embeddings = np.array(embeddings, dtype=np.float32)
+        with _index_lock.write():
+            _index.add(embeddings)
+            _id_map.extend(_as_uuid(mid) for mid, _ in items)
+            _result_cache.invalidate_all()
+            _dirty = True
+    except Exception as e:
+        print(f"[FAISS] Failed to add embeddings for {[mid for mid, _ in items]}: {e}")
+
+
+def enqueue_embedding(message_id: Union[str, uuid.UUID], text: str):
+    """Queue text for indexing without blocking the caller.
+
+    Falls back to indexing inline when the background worker isn't running.
+    """
     if not text or not text.strip():
         return
-    with _lock:
-        try:
-            model = _get_model()
-            embedding = model.encode([text], normalize_embeddings=True)
-            embedding = np.array(embedding, dtype=np.float32)
-            _index.add(embedding)
-            _id_map.append(message_id)
-            _save_index()
-        except Exception as e:
-            print(f"[FAISS] Failed to add embedding for {message_id}: {e}")
+    if _embed_queue is None:
+        add_embedding(message_id, text)
+        return
+    _embed_queue.put_nowait((message_id, text))
 
 
-def search(query: str, top_k: int = 20) -> List[str]:
-    """Return message_ids most semantically similar to query."""
+async def run_embedding_worker():
+    """Background task: drain the queue in micro-batches of up to EMBED_BATCH_SIZE."""
+    global _embed_queue
+    _embed_queue = asyncio.Queue()
+    try:
+        while True:
+            batch = [await _embed_queue.get()]
+            while len(batch) < EMBED_BATCH_SIZE and not _embed_queue.empty():
+                batch.append(_embed_queue.get_nowait())
+            # torch releases the GIL during the forward pass, so a thread is enough.
+            # If cancelled meanwhile the thread still finishes this batch, so the
+            # shutdown drain below must not see it again.
+            await asyncio.to_thread(add_embeddings_batch, batch)
+    except asyncio.CancelledError:
+        # Shutting down: index whatever is still queued before exiting
+        pending = []
+        while not _embed_queue.empty():
+            pending.append(_embed_queue.get_nowait())
+        add_embeddings_batch(pending)
+        _embed_queue = None
+        raise
+
+
+def search(query: str, top_k: int = 20, query_vec: Optional[np.ndarray] = None) -> List[uuid.UUID]:
+    """Return message_ids most semantically similar to query (highest cosine similarity first)."""
+    return search_batch([query], top_k, None if query_vec is None else [query_vec])[0]
+
+
+def search_batch(
+    queries: List[str], top_k: int = 20, query_vecs: Optional[List[np.ndarray]] = None
+) -> List[List[uuid.UUID]]:
+    """Run several queries with one encode call and one FAISS search call.
+
+    ``query_vecs`` are the queries' encode_query() vectors, if already computed.
+    """
     if _index is None or _index.ntotal == 0:
-        return []
-    with _lock:
-        try:
-            model = _get_model()
-            query_vec = model.encode([query], normalize_embeddings=True)
-            query_vec = np.array(query_vec, dtype=np.float32)
+        return [[] for _ in queries]
+    results = [_result_cache.get((q, top_k)) for q in queries]
+    missing = [i for i, r in enumerate(results) if r is None]
+    if not missing:
+        return results
+    try:
+        if query_vecs is None:
+            vecs = _encode_queries([queries[i] for i in missing])
+        else:
+            vecs = np.vstack([query_vecs[i] for i in missing])
+        with _index_lock.read():
             k = min(top_k, _index.ntotal)
-            distances, indices = _index.search(query_vec, k)
-            results = []
-            for idx in indices[0]:
-                if 0 <= idx < len(_id_map):
-                    results.append(_id_map[idx])
-            return results
-        except Exception as e:
-            print(f"[FAISS] Search failed: {e}")
-            return []
+            scores, indices = _index.search(vecs, k)
+            for i, row in zip(missing, indices):
+                ids = [_id_map[idx] for idx in row if 0 <= idx < len(_id_map)]
+                _result_cache.put((queries[i], top_k), ids)
+                results[i] = ids
+        return results
+    except Exception as e:
+        print(f"[FAISS] Search failed: {e}")
+        return [r or [] for r in results]
+
+
+async def search_batched(
+    query: str, top_k: int = 20, query_vec: Optional[np.ndarray] = None
+) -> List[uuid.UUID]:
+    """Async search() that shares a FAISS call with other requests arriving at the same time."""
+    cached = _result_cache.get((query, top_k))
+    if cached is not None:
+        return cached
+    if _search_queue is None:
+        return await asyncio.to_thread(search, query, top_k, query_vec)
+    if query_vec is None:
+        query_vec = await asyncio.to_thread(encode_query, query)
+    future = asyncio.get_running_loop().create_future()
+    _search_queue.put_nowait((query, top_k, query_vec, future))
+    return await future
+
+
+async def run_search_batcher():
+    """Background task: every SEARCH_FLUSH_MS, answer all queued searches with one search_batch().
+
+    Queries arrive already encoded, so the batch is a single FAISS call.
+    """
+    global _search_queue
+    _search_queue = asyncio.Queue()
+    pending = []
+    try:
+        while True:
+            pending = [await _search_queue.get()]
+            await asyncio.sleep(SEARCH_FLUSH_MS / 1000)
+            while len(pending) < SEARCH_MAX_BATCH and not _search_queue.empty():
+                pending.append(_search_queue.get_nowait())
+            top_k = max(k for _, k, _, _ in pending)
+            results = await asyncio.to_thread(
+                search_batch, [q for q, _, _, _ in pending], top_k, [v for _, _, v, _ in pending]
+            )
+            for (_, k, _, future), ids in zip(pending, results):
+                if not future.done():
+                    future.set_result(ids[:k])
+            pending = []
+    except asyncio.CancelledError:
+        while not _search_queue.empty():
+            pending.append(_search_queue.get_nowait())
+        for _, _, _, future in pending:
+            future.cancel()
+        _search_queue = None
+        raise
 
 
 # ─── Sentence-level add / search (new) ───────────────────────────────────────
 
-def add_document_sentences(message_id: str, sentences: List[str]):
+def add_document_sentences(message_id: Union[str, uuid.UUID], sentences: List[str]):
     """
     Encode each sentence and add to the sentence-level FAISS index.
     Each entry in _sent_map stores {message_id, sentence}.
     """
+    global _sent_dirty
     if not sentences:
         return
-    with _lock:
-        try:
-            model = _get_model()
-            embeddings = model.encode(sentences, normalize_embeddings=True, show_progress_bar=False)
-            embeddings = np.array(embeddings, dtype=np.float32)
+    try:
+        model = _get_model()
+        embeddings = model.encode(sentences, normalize_embeddings=True, show_progress_bar=False)
+        embeddings = np.array(embeddings, dtype=np.float32)
+        mid = _as_uuid(message_id)
+        with _sent_lock.write():
             _sent_index.add(embeddings)
-            for s in sentences:
-                _sent_map.append({"message_id": message_id, "sentence": s})
-            _save_sent_index()
-            print(f"[FAISS] Indexed {len(sentences)} sentences for message {message_id}")
-        except Exception as e:
-            print(f"[FAISS] Failed to index sentences for {message_id}: {e}")
+            _sent_map.extend({"message_id": mid, "sentence": s} for s in sentences)
+            _sent_dirty = True
+        print(f"[FAISS] Indexed {len(sentences)} sentences for message {message_id}")
+    except Exception as e:
+        print(f"[FAISS] Failed to index sentences for {message_id}: {e}")
 
 
-def search_sentences(query: str, top_k: int = 10) -> List[Dict]:
+def search_sentences(query: str, top_k: int = 10, query_vec: Optional[np.ndarray] = None) -> List[Dict]:
     """
     Return list of {message_id, sentence} dicts most semantically similar to query.
     Deduplicates: only the best-matching sentence per message is returned.
     """
     if _sent_index is None or _sent_index.ntotal == 0:
         return []
-    with _lock:
-        try:
-            model = _get_model()
-            query_vec = model.encode([query], normalize_embeddings=True)
-            query_vec = np.array(query_vec, dtype=np.float32)
+    try:
+        vecs = _encode_queries([query]) if query_vec is None else np.vstack([query_vec])
+        with _sent_lock.read():
             k = min(top_k * 3, _sent_index.ntotal)   # fetch extra, deduplicate by message
-            distances, indices = _sent_index.search(query_vec, k)
-            seen_msgs = set()
-            results = []
-            for idx in indices[0]:
-                if 0 <= idx < len(_sent_map):
-                    entry = _sent_map[idx]
-                    mid = entry["message_id"]
-                    if mid not in seen_msgs:
-                        seen_msgs.add(mid)
-                        results.append(entry)
-                        if len(results) >= top_k:
-                            break
-            return results
-        except Exception as e:
-            print(f"[FAISS] Sentence search failed: {e}")
-            return []
+            scores, indices = _sent_index.search(vecs, k)
+            entries = [_sent_map[idx] for idx in indices[0] if 0 <= idx < len(_sent_map)]
+        seen_msgs = set()
+        results = []
+        for entry in entries:
+            mid = entry["message_id"]
+            if mid not in seen_msgs:
+                seen_msgs.add(mid)
+                results.append(entry)
+                if len(results) >= top_k:
+                    break
+        return results
+    except Exception as e:
+        print(f"[FAISS] Sentence search failed: {e}")
+        return []
@@ -1,8 +1,9 @@
-import json
-from typing import Dict, Set, Optional
+import asyncio
+import orjson
+from typing import Dict, Set, Optional, Union
 from fastapi import WebSocket
 from sqlalchemy import update
-from app.database import AsyncSessionLocal
+from app.database import engine
 from app import models
 
 # room_id -> set of WebSocket connections
@@ -16,11 +17,10 @@ async def connect(room_id: str, websocket: WebSocket, user_id: Optional[str] = N
     _connections[room_id].add(websocket)
     
     if user_id:
-        async with AsyncSessionLocal() as db:
-            await db.execute(
+        async with engine.begin() as conn:
+            await conn.execute(
                 update(models.User).where(models.User.id == user_id).values(is_online=True)
             )
-            await db.commit()
     print(f"[WS] Client {user_id} connected to room {room_id}. Total: {len(_connections[room_id])}")
 
 
@@ -31,24 +31,29 @@ async def disconnect(room_id: str, websocket: WebSocket, user_id: Optional[str]
             del _connections[room_id]
             
     if user_id:
-        async with AsyncSessionLocal() as db:
-            await db.execute(
+        async with engine.begin() as conn:
+            await conn.execute(
                 update(models.User).where(models.User.id == user_id).values(is_online=False)
             )
-            await db.commit()
     print(f"[WS] Client {user_id} disconnected from room {room_id}")
 
 
-async def broadcast_message(room_id: str, data: dict):
-    """Send a message to all connected clients in a room."""
+async def broadcast_message(room_id: str, data: Union[dict, str]):
+    """Send a message to all connected clients in a room.
+
+    ``data`` is either a dict or an already JSON-encoded string; either way it
+    is encoded once and the same text frame goes to every client concurrently.
+    """
     if room_id not in _connections:
         return
-    dead = set()
-    payload = json.dumps(data, default=str)
-    for ws in list(_connections[room_id]):
-        try:
-            await ws.send_text(payload)
-        except Exception:
-            dead.add(ws)
-    for ws in dead:
-        _connections[room_id].discard(ws)
+    payload = data if isinstance(data, str) else orjson.dumps(data, default=str).decode("utf-8")
+    clients = list(_connections[room_id])
+    results = await asyncio.gather(
+        *(ws.send_text(payload) for ws in clients), return_exceptions=True
+    )
+    room = _connections.get(room_id)
+    if room is None:
+        return
+    for ws, result in zip(clients, results):
+        if isinstance(result, Exception):
+            room.discard(ws)
@@ -0,0 +1,34 @@
+import asyncio
+import sys
+import os
+
+# Add the current directory to sys.path so we can import app
+sys.path.append(os.getcwd())
+
+from sqlalchemy import text
+from app.database import engine, create_tables
+
+async def migrate_deleted_for():
+    # Make sure message_hidden_for exists before copying into it
+    await create_tables()
+    async with engine.begin() as conn:
+        print("Copying messages.deleted_for into message_hidden_for...")
+        try:
+            result = await conn.execute(text("""
+                INSERT INTO message_hidden_for (message_id, user_id)
+                SELECT m.id, u.id
+                FROM messages m
+                CROSS JOIN LATERAL unnest(string_to_array(m.deleted_for, ',')) AS d(user_id)
+                JOIN users u ON u.id::text = d.user_id
+                WHERE m.deleted_for IS NOT NULL AND m.deleted_for <> ''
+                ON CONFLICT DO NOTHING
+            """))
+            print(f"Copied {result.rowcount} hidden-message entries.")
+        except Exception as e:
+            if "deleted_for" in str(e) and "does not exist" in str(e):
+                print("messages.deleted_for column not found; nothing to migrate.")
+            else:
+                print(f"Error migrating deleted_for: {e}")
+
+if __name__ == "__main__":
+    asyncio.run(migrate_deleted_for())
@@ -0,0 +1,54 @@
+"""Search result rows → response schemas. Run from backend/: python -m unittest discover -s tests -t ."""
+import unittest
+import uuid
+from datetime import datetime, timezone
+
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.schema import CreateTable
+
+from app import models
+from app.routers import search
+
+
+class MessageOutFromRowTest(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine("sqlite://")
+        with self.engine.begin() as conn:
+            # Tables only: the Postgres-specific indexes can't be built in SQLite
+            conn.execute(CreateTable(models.User.__table__))
+            conn.execute(CreateTable(models.Message.__table__))
+
+    def tearDown(self):
+        self.engine.dispose()
+
+    def test_message_out_from_joined_row(self):
+        user_id, message_id = uuid.uuid4(), uuid.uuid4()
+        now = datetime.now(timezone.utc)
+        with self.engine.begin() as conn:
+            conn.execute(insert(models.User).values(
+                id=user_id, username="alice", email="alice@ex.com",
+                hashed_password="x", about="hi", is_online=True, created_at=now,
+            ))
+            conn.execute(insert(models.Message).values(
+                id=message_id, room_id=uuid.uuid4(), sender_id=user_id,
+                content="hello apples", message_type=models.MessageType.text,
+                is_transcribed=False, is_deleted=False, created_at=now,
+            ))
+            row = conn.execute(
+                select(*search._RESULT_COLUMNS)
+                .join(models.User, models.User.id == models.Message.sender_id)
+            ).one()
+
+        out = search._message_out(row)
+
+        self.assertEqual(out.id, message_id)
+        self.assertEqual(out.sender_id, user_id)
+        self.assertEqual(out.content, "hello apples")
+        self.assertEqual(out.message_type, "text")
+        self.assertEqual(out.sender.id, user_id)
+        self.assertEqual(out.sender.username, "alice")
+        self.assertTrue(out.sender.is_online)
+
+
+if __name__ == "__main__":
+    unittest.main()